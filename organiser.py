@@ -1,17 +1,18 @@
 #!/usr/bin/env python3
 
-import argparse
 import collections
-import copy
+import concurrent.futures
 import hashlib
+import json
 import locale
+import mmap
 import os
 import pathlib
 import re
 import shutil
 import struct
 import sys
-import tempfile
+import threading
 import time
 import typing
 
@@ -20,6 +21,12 @@ import py7zr
 import py7zr.exceptions
 import yaml
 
+# Prefer the libyaml bindings for migrating old DSF caches, falling back to pure Python if they're unavailable
+try:
+    from yaml import CSafeLoader as _YLoader
+except ImportError:
+    from yaml import SafeLoader as _YLoader
+
 # Global constant declarations
 XP10_GLOBAL_AIRPORTS = "SCENERY_PACK Custom Scenery/Global Airports/\n"
 XP12_GLOBAL_AIRPORTS = "SCENERY_PACK *GLOBAL_AIRPORTS*\n"
@@ -27,12 +34,38 @@ FILE_LINE_REL = "SCENERY_PACK Custom Scenery/"
 FILE_LINE_ABS = "SCENERY_PACK "
 FILE_DISAB_LINE_REL = "SCENERY_PACK_DISABLED Custom Scenery/"
 FILE_DISAB_LINE_ABS = "SCENERY_PACK_DISABLED "
+FILE_LINE_ABS_LEN = len(FILE_LINE_ABS)
+FILE_DISAB_LINE_ABS_LEN = len(FILE_DISAB_LINE_ABS)
+FILE_LINE_PREFIXES = {(False, False): FILE_LINE_REL, (False, True): FILE_LINE_ABS,
+                      (True, False): FILE_DISAB_LINE_REL, (True, True): FILE_DISAB_LINE_ABS}  # keyed by (disabled, shortcut)
 FILE_BEGIN = "I\n1000 Version\nSCENERY\n\n"
-BUF_SIZE = 65536
+BUF_SIZE = 1 << 20  # 1 MiB
+CACHE_FILE = "sporganiser_cache.json"
+CACHE_FILE_LEGACY = "sporganiser_cache.yaml"
+SEVENZIP_MAGIC = b"7z\xbc\xaf\x27\x1c"
+PROGRESS_INTERVAL = 0.05  # seconds between progress line refreshes
+APT_ROW_CODES = ("1 ", "16 ", "17 ")  # apt.dat row codes for airport, seaport, heliport
+TILE_REGEX = re.compile(r"[+-]\d{2}[+-]\d{3}")
+DISAB_REGEX = re.compile(r"SCENERY_PACK_DISABLED (Custom Scenery/)?(.*?)/?$")  # group 1 set if relative, group 2 is the pack path
+DEFAULT_APT_TOKENS = ("Demo Area", "X-Plane Airports", "X-Plane Landmarks", "Aerosoft")
+DEFAULT_OVERLAY_TOKENS = ("X-Plane Landmarks",)
+# AutoOrtho tokens are case sensitive, prefab and SimHeaven are not
+QUIRK_REGEX = re.compile(r"(?P<ao_overlay>yAutoOrtho_Overlays)"
+                         r"|(?P<ao_region>z_ao_(?:na|sa|eur|afr|asi|aus_pac))"
+                         r"|(?P<ao_root>z_autoortho)"
+                         r"|(?P<prefab>(?i:prefab))"
+                         r"|(?P<simheaven>(?i:simheaven))")
+QUIRK_LABELS = {"ao_overlay": "AO Overlay", "ao_region": "AO Region", "ao_root": "AO Root", "prefab": "Prefab Apt", "simheaven": "SimHeaven"}
+
+# Struct declarations for .lnk fields, which are little endian regardless of host
+LNK_UINT = struct.Struct("<I")
+LNK_USHORT = struct.Struct("<H")
+DSF_ATOM = struct.Struct("<4si")  # atom id (byte-reversed) and size
 
 # Named tuple declarations
 SortPacksResult = collections.namedtuple("SortPacksResult", ["unsorted_registry", "quirks", "airports", "overlays", "meshes", "other"])
 AirportData = collections.namedtuple("AirportData", ["icao_registry", "airport_registry"])
+AirportRecord = collections.namedtuple("AirportRecord", ["path", "line", "icaos"])
 
 
 # TODO: Steam X-Plane support
@@ -84,7 +117,7 @@ class LocateXPlane:
                     install_file = self.prefs_folder / f"x-plane_install{version}.txt"
                     with open(install_file, "r", encoding="utf-8") as file:
                         # ...and read its lines to get potential install paths
-                        for install_line in file.readlines():
+                        for install_line in file:
                             self.direct_lines.append([f"X-Plane {formatted_version}", install_line, install_file])
                 # In case the text file for this version doesn't exist
                 except FileNotFoundError:
@@ -99,29 +132,28 @@ class LocateXPlane:
 
     # Test direct installs and remove stale paths
     def direct_test(self) -> None:
-        # Create a copy of our record of direct lines to avoid errors with the iterable changing during iteration
-        direct_lines_copy = copy.deepcopy(self.direct_lines)
-        # Loop through the parsed lines...
-        for version, install_line, install_file in direct_lines_copy:
+        # Loop through the parsed lines, keeping valid ones and noting stale ones by the text file they came from
+        valid_lines = list()
+        stale_lines = dict()
+        for version, install_line, install_file in self.direct_lines:
             install_path = pathlib.Path(install_line.strip("\n"))
-            # ...and test each path to ensure it's not "old and stale". if it is...
+            # ...and test each path to ensure it's not "old and stale"
             if (install_path / "Custom Scenery").exists() and (install_path / "Resources").exists():
                 if self.verbose >= 2:
                     print(f"  [I] LocateXPlane direct_test: validated {install_path}")
+                valid_lines.append([version, install_line, install_file])
             else:
-                # ...remove it from the text file!
                 print(f"Removing stale path {install_path} from {install_file}")
-                file_lines = list()
-                with open(self.prefs_folder / install_file, "r+", encoding="utf-8") as file:
-                    for file_line in file.readlines():
-                        if file_line == install_line:
-                            continue
-                        file_lines.append(file_line)
-                    file.seek(0)
-                    file.writelines(file_lines)
-                    file.truncate()
-                # Oh and remove it from our record too :)
-                self.direct_lines.remove([version, install_line, install_file])
+                stale_lines.setdefault(install_file, set()).add(install_line)
+        # Remove stale paths from each text file, rewriting it only once...
+        for install_file, stale_set in stale_lines.items():
+            with open(install_file, "r+", encoding="utf-8") as file:
+                file_lines = [file_line for file_line in file if file_line not in stale_set]
+                file.seek(0)
+                file.writelines(file_lines)
+                file.truncate()
+        # ...oh and remove them from our record too :)
+        self.direct_lines = valid_lines
 
     # Get user input
     def get_choice(self) -> None:
@@ -158,17 +190,21 @@ class LocateXPlane:
 
 # TODO: macOS Alias support
 class SortPacks:
-    def __init__(self, verbose: int, xplane_path: pathlib.Path, temp_path: pathlib.Path) -> None:
+    def __init__(self, verbose: int, xplane_path: pathlib.Path, temp_dir: "LazyTempDir", paranoid: bool = False) -> None:
         # External variable declarations
         self.verbose = verbose
         self.xplane_path = xplane_path
-        self.temp_path = temp_path
+        self.temp_dir = temp_dir
+        self.paranoid = paranoid
+        self.scenery_path = xplane_path / "Custom Scenery"
         # Internal variable declarations
-        self.icao_registry = {}     # dict of ICAO codes and the number of packs serving each
+        self.icao_registry = collections.Counter()  # counter of ICAO codes and the number of packs serving each
         self.disable_registry = {}  # dict that holds the folder line and beginning line of disabled packs
         self.dsferror_registry = []  # list of errored dsfs
         self.unparsed_registry = []  # list of .lnk shortcuts that couldn't be parsed
-        self.airport_registry = {"path": [], "line": [], "icaos": []}
+        self.dsf_cache_registry = {}  # dict of validated dsf caches, keyed by Earth nav data folder
+        self.quirk_registry = {}  # dict of quirks found in each pack name
+        self.airport_registry = {}   # dict of airport pack paths, each holding the ini line and list of ICAO codes served
         # Classification variable declarations
         self.unsorted_registry = []      # list of packs that couldn't be classified
         self.quirks = {"Prefab Apt": [], "AO Overlay": [], "AO Region": [], "AO Root": [], "SimHeaven": []}
@@ -203,15 +239,14 @@ class SortPacks:
 
     # Read old ini to get list of disabled packs
     def import_disabled(self) -> None:
-        deployed_ini_path = self.xplane_path / "Custom Scenery" / "scenery_packs.ini"
-        unsorted_ini_path = self.xplane_path / "Custom Scenery" / "scenery_packs_unsorted.ini"
+        deployed_ini_path = self.scenery_path / "scenery_packs.ini"
+        unsorted_ini_path = self.scenery_path / "scenery_packs_unsorted.ini"
         if deployed_ini_path.is_file():
             with open(deployed_ini_path, "r", encoding="utf-8") as deployed_ini_file:
-                for line in deployed_ini_file.readlines():
-                    for disabled in [FILE_DISAB_LINE_REL, FILE_DISAB_LINE_ABS]:
-                        if line.startswith(disabled):
-                            self.disable_registry[line.split(disabled, maxsplit=1)[1].strip("\n")[:-1]] = disabled
-                            break
+                for line in deployed_ini_file:
+                    disabled = DISAB_REGEX.match(line)
+                    if disabled:
+                        self.disable_registry[disabled[2]] = FILE_DISAB_LINE_REL if disabled[1] else FILE_DISAB_LINE_ABS
             if self.verbose >= 1:
                 print("  [I] SortPacks import_disabled: loaded existing ini")
         elif self.verbose >= 1:
@@ -219,14 +254,10 @@ class SortPacks:
         # Read unsorted ini to remove packs disabled for being unclassified
         if unsorted_ini_path.is_file():
             with open(unsorted_ini_path, "r", encoding="utf-8") as unsorted_ini_file:
-                for line in unsorted_ini_file.readlines():
-                    for disabled in [FILE_DISAB_LINE_REL, FILE_DISAB_LINE_ABS]:
-                        if line.startswith(disabled):
-                            try:
-                                del self.disable_registry[line.split(disabled, maxsplit=1)[1].strip("\n")[:-1]]
-                                break
-                            except KeyError:
-                                pass
+                for line in unsorted_ini_file:
+                    disabled = DISAB_REGEX.match(line)
+                    if disabled:
+                        self.disable_registry.pop(disabled[2], None)
             if self.verbose >= 1:
                 print("  [I] SortPacks import_disabled: loaded unsorted ini")
         elif self.verbose >= 1:
@@ -250,39 +281,50 @@ class SortPacks:
     # This code is adapted from https://gist.github.com/nitori/6e7be6c9f00411c12aacc1ee964aee88 - thank you very much!
     # Ref: https://developer.x-plane.com/article/dsf-file-format-specification/
     # Ref: https://developer.x-plane.com/article/dsf-usage-in-x-plane/
-    def mesh_dsf_decode(self, filepath: pathlib.Path) -> typing.Union[list, str]:
+    # If stop_after is given, return as soon as that atom is read and skip the checksum
+    def mesh_dsf_decode(self, filepath: pathlib.Path, stop_after: bytes = None) -> typing.Union[list, str]:
+        # Open first, so a missing dsf is told apart from a bad one. The size comes from the map, no separate stat needed
         try:
-            size = os.stat(filepath).st_size
+            dsf = open(filepath, "rb")
         except FileNotFoundError:
             if self.verbose >= 2:
                 print(f"  [E] SortPacks mesh_dsf_decode: expected dsf '{str(filepath.name)}'")
                 print(f"                 extracted files from dsf: {self.misc_functions.dir_list(filepath.parent.absolute(), 'files')}")
             return "ERR: DCDE: NameMatch"
-        footer_start = size - 16  # 16 byte (128bit) for md5 hash
-        digest = hashlib.md5()
+        # Anything else that stops it opening (permissions, a directory, a locked file) means a bad dsf
+        except OSError as e:
+            if self.verbose >= 2:
+                print(f"  [E] SortPacks mesh_dsf_decode: could not open dsf '{e}'")
+            return "ERR: DCDE: BadDSFErr"
         try:
-            with open(filepath, "rb") as dsf:
+            with dsf, mmap.mmap(dsf.fileno(), 0, access=mmap.ACCESS_READ) as dsf_map:
+                footer_start = len(dsf_map) - 16  # 16 byte (128bit) for md5 hash
                 # Read 8s = 8 byte string, and "i" = 1 32 bit integer (total: 12 bytes)
-                raw_header = dsf.read(12)
-                header, version = struct.unpack("<8si", raw_header)
-                digest.update(raw_header)
+                header, version = struct.unpack_from("<8si", dsf_map, 0)
                 # Proceed only if the version and header match what we expect, else return a string
                 if version == 1 and header == b"XPLNEDSF":
-                    # Process dsf, updating digest and dsf_data
+                    # Process dsf, walking the atoms in place
                     dsf_data = []
-                    while dsf.tell() < footer_start:
-                        raw_atom_header = dsf.read(8)
-                        digest.update(raw_atom_header)
+                    position = 12
+                    while position < footer_start:
                         # 32bit atom id + 32 bit atom_size.. total: 8 byte
-                        atom_id, atom_size = struct.unpack("<ii", raw_atom_header)
-                        atom_id = struct.pack(">i", atom_id)  # "DAEH" -> "HEAD"
-                        # Data size is atom_size excluding the just read 8 byte id+size header
-                        atom_data = dsf.read(atom_size - 8)
-                        digest.update(atom_data)
+                        atom_id, atom_size = DSF_ATOM.unpack_from(dsf_map, position)
+                        if atom_size < 8:
+                            if self.verbose >= 2:
+                                print(f"  [E] SortPacks mesh_dsf_decode: bad atom size. got '{atom_size}'")
+                            return "ERR: DCDE: BadDSFErr"
+                        atom_id = atom_id[::-1]  # "DAEH" -> "HEAD"
+                        # Data size is atom_size excluding the 8 byte id+size header
+                        atom_data = dsf_map[position + 8:position + atom_size]
                         dsf_data.append((atom_id, atom_data))
-                    # Remaining bit is the checksum, ensure it matches. If not, return a string
-                    checksum = dsf.read()
-                    if checksum != digest.digest():
+                        if stop_after and atom_id == stop_after:
+                            return dsf_data
+                        position += atom_size
+                    # Remaining bit is the checksum of everything before it, ensure it matches. If not, return a string
+                    checksum = dsf_map[position:]
+                    with memoryview(dsf_map) as dsf_view:
+                        digest = hashlib.md5(dsf_view[:position]).digest()
+                    if checksum != digest:
                         if self.verbose >= 2:
                             print(f"  [E] SortPacks mesh_dsf_decode: checksum mismatch")
                         return "ERR: DCDE: !Checksum"
@@ -309,96 +351,128 @@ class SortPacks:
                 print(f"  [E] SortPacks mesh_dsf_decode: unhandled error '{e}'")
             return "ERR: DCDE: BadDSFErr"
 
-    # Caching stuff for DSF
-    def mesh_dsf_cache(self, end_directory: pathlib.Path, tag: str, value: str = "", tile: str = "") -> typing.Union[str, None]:
-        # Attempt to fetch cache
+    # Load and validate the DSF cache for an Earth nav data folder
+    # This is done at most once per folder in a run, later calls get the in-memory copy
+    def mesh_dsf_cache_load(self, end_directory: pathlib.Path) -> dict:
+        cache_key = str(end_directory)
+        if cache_key in self.dsf_cache_registry:
+            return self.dsf_cache_registry[cache_key]
+        cache_path = end_directory.parent / CACHE_FILE
+        # Attempt to fetch cache. It ships inside third party packs, so it is only ever parsed as plain data
+        # Anything unreadable is treated as a cold cache, so one bad pack can't stop the rest being sorted
         try:
-            with open(end_directory.parent.absolute() / "sporganiser_cache.yaml", "r") as yaml_file:
-                dsf_cache_data = yaml.load(yaml_file, Loader=yaml.FullLoader)
+            with open(cache_path, "r", encoding="utf-8") as json_file:
+                dsf_cache_data = json.load(json_file)
                 if self.verbose >= 2:
-                    print(f"  [I] SortPacks mesh_dsf_cache: loaded cache")
+                    print(f"  [I] SortPacks mesh_dsf_cache_load: loaded cache")
         except FileNotFoundError:
             dsf_cache_data = {"version": 220}
+            # One-shot migration of caches written by older versions
+            legacy_path = end_directory.parent / CACHE_FILE_LEGACY
+            try:
+                with open(legacy_path, "r") as yaml_file:
+                    dsf_cache_data = yaml.load(yaml_file, Loader=_YLoader)
+                if isinstance(dsf_cache_data, dict):
+                    self.mesh_dsf_cache_write(end_directory, dsf_cache_data)
+                    if self.verbose >= 2:
+                        print(f"  [I] SortPacks mesh_dsf_cache_load: migrated legacy yaml cache")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                if self.verbose >= 1:
+                    print(f"  [W] SortPacks mesh_dsf_cache_load: could not migrate legacy yaml cache '{e}'")
+                dsf_cache_data = {"version": 220}
+        except Exception as e:
+            if self.verbose >= 1:
+                print(f"  [W] SortPacks mesh_dsf_cache_load: unreadable cache '{e}'")
+            dsf_cache_data = {"version": 220}
+        if not isinstance(dsf_cache_data, dict):
+            if self.verbose >= 1:
+                print(f"  [W] SortPacks mesh_dsf_cache_load: cache is not a mapping. got '{type(dsf_cache_data).__name__}'")
+            dsf_cache_data = {"version": 220}
+        # Validate cache
+        try:
+            for dsf in list(dsf_cache_data.keys()):
+                # Check version
+                if dsf == "version":
+                    if not dsf_cache_data[dsf] == 220:
+                        if self.verbose >= 2:
+                            print(f"  [W] SortPacks mesh_dsf_cache_load: unknown version tag. got '{dsf_cache_data[dsf]}'")
+                        dsf_cache_data = {"version": 220}
+                        break
+                    continue
+                # Locate dsf cached and check that it exists
+                dsf_path = end_directory / dsf
+                try:
+                    dsf_stat = os.stat(dsf_path)
+                except FileNotFoundError:
+                    if self.verbose >= 2:
+                        print(f"  [W] SortPacks mesh_dsf_cache_load: cached dsf '{str(dsf_path)}' doesn't exist")
+                    del dsf_cache_data[dsf]
+                    continue
+                # Check size and mtime to ensure cached data is still valid. Entries from older versions lack these and are invalidated
+                if dsf_cache_data[dsf].get("size") != dsf_stat.st_size or dsf_cache_data[dsf].get("mtime_ns") != dsf_stat.st_mtime_ns:
+                    if self.verbose >= 2:
+                        print(f"  [W] SortPacks mesh_dsf_cache_load: size or mtime of cached dsf '{str(dsf_path)}' doesn't match")
+                    del dsf_cache_data[dsf]
+                    continue
+                # If paranoid, hash dsf as well
+                if self.paranoid and dsf_cache_data[dsf].get("hash") != self.misc_functions.file_hash(dsf_path):
+                    if self.verbose >= 2:
+                        print(f"  [W] SortPacks mesh_dsf_cache_load: hash of cached dsf '{str(dsf_path)}' doesn't match")
+                    del dsf_cache_data[dsf]
+                    continue
+        # Safety net
+        except Exception as e:
+            if self.verbose >= 2:
+                print(f"  [E] SortPacks mesh_dsf_cache_load: unhandled error '{e}'")
+            dsf_cache_data = {"version": 220}
+        self.dsf_cache_registry[cache_key] = dsf_cache_data
+        return dsf_cache_data
+
+    # Write the DSF cache for an Earth nav data folder
+    # A pack we can't write to just goes uncached
+    def mesh_dsf_cache_write(self, end_directory: pathlib.Path, dsf_cache_data: dict) -> None:
+        try:
+            with open(end_directory.parent / CACHE_FILE, "w", encoding="utf-8") as json_file:
+                json.dump(dsf_cache_data, json_file, separators=(",", ":"))
+        except OSError as e:
+            if self.verbose >= 1:
+                print(f"  [W] SortPacks mesh_dsf_cache_write: could not write cache '{e}'")
+
+    # Caching stuff for DSF
+    def mesh_dsf_cache(self, end_directory: pathlib.Path, tag: str, value: str = "", tile: str = "") -> typing.Union[str, None]:
+        dsf_cache_data = self.mesh_dsf_cache_load(end_directory)
         # If value given, operate in write mode
         if str(value) and str(tile):
-            # Generate hashes
-            sha1 = hashlib.sha1()
-            md5 = hashlib.md5()
-            with open(end_directory / tile, "rb") as dsf_file:
-                while True:
-                    data = dsf_file.read(BUF_SIZE)
-                    if not data:
-                        break
-                    sha1.update(data)
-                    md5.update(data)
+            # Note file identity, and hash only if asked to be paranoid
+            dsf_path = end_directory / tile
+            dsf_stat = os.stat(dsf_path)
+            dsf_cache_entry = {tag: value, "size": dsf_stat.st_size, "mtime_ns": dsf_stat.st_mtime_ns}
+            if self.paranoid:
+                dsf_cache_entry["hash"] = self.misc_functions.file_hash(dsf_path)
             # Store result to speed up future runs
-            dsf_cache_data_new = {f"{tile}": {tag: value, "md5": md5.hexdigest(), "sha1": sha1.hexdigest()}}
-            dsf_cache_data.update(dsf_cache_data_new)
-            with open(end_directory.parent.absolute() / "sporganiser_cache.yaml", "w") as yaml_file:
-                yaml.dump(dsf_cache_data, yaml_file)
+            dsf_cache_data[tile] = dsf_cache_entry
+            self.mesh_dsf_cache_write(end_directory, dsf_cache_data)
             if self.verbose >= 2:
                 print(f"  [I] SortPacks mesh_dsf_cache: new cache written")
-        # Otherwise, operate in read mode
+        # Otherwise, operate in read mode and attempt to get the tag data requested
         else:
-            # Read cache
-            dsf_cache_data_iter = copy.deepcopy(dsf_cache_data)
-            try:
-                for dsf in dsf_cache_data_iter:
-                    # Check version
-                    if dsf == "version":
-                        if not dsf_cache_data[dsf] == 220:
-                            if self.verbose >= 2:
-                                print(f"  [W] SortPacks mesh_dsf_cache: unknown version tag. got '{dsf_cache_data[dsf]}'")
-                            dsf_cache_data = {"version": 220}
-                            break
-                        continue
-                    # Locate dsf cached and check that it exists
-                    dsf_path = end_directory / dsf
-                    if not dsf_path.exists():
-                        if self.verbose >= 2:
-                            print(f"  [W] SortPacks mesh_dsf_cache: cached dsf '{str(dsf_path)}' doesn't exist")
-                        del dsf_cache_data[dsf]
-                        continue
-                    # Hash dsf to ensure cached data is still valid
-                    sha1 = hashlib.sha1()
-                    md5 = hashlib.md5()
-                    with open(dsf_path, "rb") as dsf_file:
-                        while True:
-                            data = dsf_file.read(BUF_SIZE)
-                            if not data:
-                                break
-                            sha1.update(data)
-                            md5.update(data)
-                    if not (dsf_cache_data[dsf]["md5"] == md5.hexdigest() and dsf_cache_data[dsf]["sha1"] == sha1.hexdigest()):
-                        if self.verbose >= 2:
-                            print(f"  [W] SortPacks mesh_dsf_cache: hash of cached dsf '{str(dsf_path)}' doesn't match")
-                        del dsf_cache_data[dsf]
-                        continue
-                    # Attempt to get the tag data requested
-                    try:
-                        tag_data = dsf_cache_data[dsf][tag]
-                        return tag_data
-                    except KeyError:
-                        pass
-            # Safety net
-            except Exception as e:
-                if self.verbose >= 2:
-                    print(f"  [E] SortPacks mesh_dsf_cache: unhandled error '{e}'")
-                dsf_cache_data = {"version": 220}
+            for dsf, dsf_cache_entry in dsf_cache_data.items():
+                if dsf != "version" and tag in dsf_cache_entry:
+                    return dsf_cache_entry[tag]
 
     # Select and read DSF. Uncompress if needed and call mesh_dsf_decode()
     def mesh_dsf_read(self, end_directory: pathlib.Path, tag: str, dirname: str) -> typing.Union[bool, str]:
         data_flag = 0
         # Attempt to fetch results from cache
         dsf_read_result = self.mesh_dsf_cache(end_directory, tag)
-        if dsf_read_result:
+        # Cached results can be False, so only None is a miss
+        if dsf_read_result is not None:
             data_flag = 3
         # Get list of potential tile directories to search
         list_dir = self.misc_functions.dir_list(end_directory, "dirs")
-        tile_dir = []
-        for dir in list_dir:
-            if re.search(r"[+-]\d{2}[+-]\d{3}", dir):
-                tile_dir.append(dir)
+        tile_dir = [dir for dir in list_dir if TILE_REGEX.search(dir)]
         if not tile_dir:
             if self.verbose >= 2:
                 print(f"  [E] SortPacks mesh_dsf_read: earth nav dir is empty - '{end_directory}'")
@@ -407,30 +481,39 @@ class SortPacks:
         dsf_data = None
         final_tile = None
         final_dsf = None
+        pack_directory = end_directory.parent.absolute()
         for tile in tile_dir:
-            dsfs = self.misc_functions.dir_list(end_directory / tile, "files")
+            tile_path = end_directory / tile
+            dsfs = self.misc_functions.dir_list(tile_path, "files", ".dsf")
             for dsf in dsfs:
-                # Check it's really a DSF
-                if not dsf.endswith(".dsf"):
-                    continue
                 # Space to do per-dsf stuff, eg. dsf size map
                 pass
                 # Check if we already got what we need
                 if data_flag:
                     continue
                 # If not, proceed to parse the DSF
+                dsf_path = tile_path / dsf
                 if self.verbose >= 2:
-                    print(f"  [I] SortPacks mesh_dsf_read: extracting '{end_directory / tile / dsf}'")
-                # Attempt to extract this DSF
+                    print(f"  [I] SortPacks mesh_dsf_read: extracting '{dsf_path}'")
+                # Attempt to extract this DSF, peeking at its magic bytes first so uncompressed ones skip py7zr entirely
                 try:
-                    shutil.unpack_archive(end_directory / tile / dsf, self.temp_path / dirname / dsf[:-4])
-                    uncomp_path = self.temp_path / dirname / dsf[:-4] / dsf
-                    data_flag = 2
-                    if self.verbose >= 2:
-                        print(f"  [I] SortPacks mesh_dsf_read: extracted")
+                    with open(dsf_path, "rb") as dsf_file:
+                        dsf_magic = dsf_file.read(len(SEVENZIP_MAGIC))
+                    if dsf_magic == SEVENZIP_MAGIC:
+                        extract_path = self.temp_dir.get() / dirname / dsf[:-4]
+                        shutil.unpack_archive(dsf_path, extract_path)
+                        uncomp_path = extract_path / dsf
+                        data_flag = 2
+                        if self.verbose >= 2:
+                            print(f"  [I] SortPacks mesh_dsf_read: extracted")
+                    else:
+                        uncomp_path = dsf_path
+                        data_flag = 1
+                        if self.verbose >= 2:
+                            print(f"  [I] SortPacks mesh_dsf_read: not a 7z archive. working on dsf directly")
                 # If we ran into an exception...
                 except Exception as e:
-                    uncomp_path = end_directory / tile / dsf
+                    uncomp_path = dsf_path
                     # ...and the exception was in py7zr, it was probably uncompressed already
                     if isinstance(e, py7zr.exceptions.Bad7zFile) or isinstance(e, shutil.ReadError):
                         data_flag = 1
@@ -438,15 +521,15 @@ class SortPacks:
                             print(f"  [I] SortPacks mesh_dsf_read: not a 7z archive. working on dsf directly")
                     # Otherwise, hit the safety net
                     else:
-                        self.dsferror_registry.append([f"{dsf}' in '{end_directory.parent.absolute()}", "ERR: READ: MiscError"])
+                        self.dsferror_registry.append([f"{dsf}' in '{pack_directory}", "ERR: READ: MiscError"])
                         data_flag = 0
                         if self.verbose >= 2:
                             print(f"  [E] SortPacks mesh_dsf_read: unhandled error '{e}'. working on dsf directly")
                 # Now attempt to decode this DSF
-                dsf_data = self.mesh_dsf_decode(uncomp_path)
+                dsf_data = self.mesh_dsf_decode(uncomp_path, b"HEAD" if tag == "sim/overlay 1" else None)
                 # If it returns an error, try the next one. Else, declare the final tile and dsf
                 if str(dsf_data).startswith("ERR: ") or dsf_data is None:
-                    self.dsferror_registry.append([f"{dsf} in {end_directory.parent.absolute()}", dsf_data])
+                    self.dsferror_registry.append([f"{dsf} in {pack_directory}", dsf_data])
                     data_flag = 0
                     if self.verbose >= 2:
                         print(f"  [W] SortPacks mesh_dsf_read: caught '{str(dsf_data)}' from mesh_dsf_decode")
@@ -483,73 +566,48 @@ class SortPacks:
 
     # Check if the pack is an airport
     # Ref: https://developer.x-plane.com/article/airport-data-apt-dat-12-00-file-format-specification/
-    def process_type_apt(self, dirpath: pathlib.Path, dirname: str, file_line: str, disable: bool) -> str:
+    # Returns the airport type and the ICAO codes to register, which process_main hands back to the caller
+    def process_type_apt(self, dirpath: pathlib.Path, dirname: str, disable: bool, pack_entries: list = None) -> tuple:
         # Basic checks before we move further
-        apt_path = self.misc_functions.dir_contains(dirpath, None, "apt.dat")
+        apt_path = self.misc_functions.dir_contains(dirpath, None, "apt.dat", pack_entries)
         if not apt_path:
             if self.verbose >= 2:
                 print("  [I] SortPacks process_type_apt: 'apt.dat' file not found")
-            return
-        # Attempt several codecs starting with utf-8 in case of obscure apt.dat files
-        apt_lins = None
-        for codec in ("utf-8", "charmap", "cp1252", "cp850"):
-            try:
-                if self.verbose >= 2:
-                    print(f"  [I] SortPacks process_type_apt: reading apt.dat with '{codec}'")
-                with open(apt_path, "r", encoding=codec) as apt_file:
-                    apt_lins = apt_file.readlines()
-                break
-            except UnicodeDecodeError:
-                pass
-        else:
-            if self.verbose >= 2:
-                print(f"  [W] SortPacks process_type_apt: all codecs errored out")
-        # Loop through lines
+            return None, []
+        # Read as utf-8, replacing undecodable bytes. Row codes and ICAO codes are ASCII, so obscure encodings classify the same
         apt_type = None
-        for line in apt_lins:
-            # Codes for airport, heliport, seaport
-            if line.startswith("1 ") or line.startswith("16 ") or line.startswith("17 "):
-                # Check if prefab, default, or global
-                apt_prefab = self.process_quirk_prefab(dirname)
-                if apt_prefab:
-                    apt_type = apt_prefab
-                    break
-                elif self.misc_functions.str_contains(dirname, ["Demo Area", "X-Plane Airports", "X-Plane Landmarks", "Aerosoft"]):
-                    apt_type = "Default"
-                    if self.verbose >= 2:
-                        print("  [I] SortPacks process_type_apt: found to be default airport")
-                    break
-                if apt_path and dirname == "Global Airports":
-                    apt_type = "Global"
-                    if self.verbose >= 2:
-                        print("  [I] SortPacks process_type_apt: found to be global airport")
+        apt_icaos = []
+        with open(apt_path, "r", encoding="utf-8", errors="replace") as apt_file:
+            for line in apt_file:
+                # Codes for airport, heliport, seaport
+                if not line.startswith(APT_ROW_CODES):
+                    continue
+                # Check if prefab, default, or global on the first airport found
+                if apt_type is None:
+                    apt_prefab = self.process_quirk_prefab(dirname)
+                    if apt_prefab:
+                        apt_type = apt_prefab
+                    elif self.misc_functions.str_contains(dirname, DEFAULT_APT_TOKENS):
+                        apt_type = "Default"
+                        if self.verbose >= 2:
+                            print("  [I] SortPacks process_type_apt: found to be default airport")
+                    elif dirname == "Global Airports":
+                        apt_type = "Global"
+                        if self.verbose >= 2:
+                            print("  [I] SortPacks process_type_apt: found to be global airport")
+                    # Must be custom
+                    else:
+                        apt_type = "Custom"
+                # Only enabled custom airports need the rest of the file, to note their ICAO codes
+                if apt_type != "Custom" or disable:
                     break
-                # Must be custom
-                else:
-                    apt_type = "Custom"
-                    # If pack is not to be disabled, note ICAO code from this line
-                    if not disable:
-                        splitline = line.split(maxsplit=5)
-                        icao_code = splitline[4]
-                        # Update icao registry
-                        try:
-                            self.icao_registry[icao_code] += 1
-                        except KeyError:
-                            self.icao_registry[icao_code] = 1
-                        # Update airport registry
-                        try:
-                            reg_index = self.airport_registry["path"].index(dirpath)
-                            self.airport_registry["icaos"][reg_index].append(icao_code)
-                        except ValueError:
-                            self.airport_registry["path"].append(dirpath)
-                            self.airport_registry["line"].append(file_line)
-                            self.airport_registry["icaos"].append([icao_code])
+                apt_icaos.append(line.split(maxsplit=5)[4])
         # Return result
-        return apt_type
+        return apt_type, apt_icaos
 
     # Classify as AutoOrtho, Ortho, Mesh, or Overlay after reading DSF and scanning folders
-    def process_type_mesh(self, dirpath: pathlib.Path, dirname: str) -> str:
-        end_path = self.misc_functions.dir_contains(dirpath, None, "Earth nav data")
+    def process_type_mesh(self, dirpath: pathlib.Path, dirname: str, pack_entries: list = None) -> str:
+        end_path = self.misc_functions.dir_contains(dirpath, None, "Earth nav data", pack_entries)
         # Basic check
         if not end_path:
             if self.verbose >= 2:
@@ -570,28 +628,28 @@ class SortPacks:
                 return mesh_ao
             elif mesh_simheaven in ["SimHeaven"]:
                 return mesh_simheaven
-            elif self.misc_functions.str_contains(dirname, ["X-Plane Landmarks"]):
+            elif self.misc_functions.str_contains(dirname, DEFAULT_OVERLAY_TOKENS):
                 return "Default Overlay"
             else:
                 return "Custom Overlay"
         else:
             if mesh_ao in ["AO Region", "AO Root"]:
                 return mesh_ao
-            elif self.misc_functions.dir_contains(dirpath, ["textures", "terrain"]):
+            elif self.misc_functions.dir_contains(dirpath, ["textures", "terrain"], None, pack_entries):
                 return "Ortho Mesh"
             else:
                 return "Terrain Mesh"
 
     # Check misc types
-    def process_type_other(self, dirpath: pathlib.Path, dirname: str) -> str:
+    def process_type_other(self, dirpath: pathlib.Path, dirname: str, pack_entries: list = None) -> str:
         other_result = None
-        if self.misc_functions.dir_contains(dirpath, ["library.txt"], "generic"):
+        if self.misc_functions.dir_contains(dirpath, ["library.txt"], "generic", pack_entries):
             other_result = "Library"
             # Check for SimHeaven
             other_simheaven = self.process_quirk_simheaven(dirname)
             if other_simheaven:
                 other_result = other_simheaven
-        if self.misc_functions.dir_contains(dirpath, ["plugins"]):
+        if self.misc_functions.dir_contains(dirpath, ["plugins"], None, pack_entries):
             other_result = "Plugin"
         if self.verbose >= 2 and other_result:
             print(f"  [I] SortPacks process_type_other: found to be {other_result}")
@@ -599,17 +657,25 @@ class SortPacks:
             print(f"  [I] SortPacks process_type_other: neither library.txt nor plugins folder found")
         return other_result
 
+    # Find every quirk token in the pack name with one scan of the precompiled quirk regex
+    # Called by the process_quirk_* functions
+    def process_quirks(self, dirname: str) -> frozenset:
+        try:
+            return self.quirk_registry[dirname]
+        except KeyError:
+            quirk_result = frozenset(QUIRK_LABELS[match.lastgroup] for match in QUIRK_REGEX.finditer(dirname))
+            self.quirk_registry[dirname] = quirk_result
+            return quirk_result
+
     # Check if the pack is from AutoOrtho
     # Called in process_type_apt after pack is confirmed to be airport
     def process_quirk_ao(self, dirname: str) -> str:
-        ao_regions = ["na", "sa", "eur", "afr", "asi", "aus_pac"]
+        quirks = self.process_quirks(dirname)
         ao_result = None
-        if self.misc_functions.str_contains(dirname, ["yAutoOrtho_Overlays"]):
-            ao_result = "AO Overlay"
-        elif self.misc_functions.str_contains(dirname, [f"z_ao_{region}" for region in ao_regions]):
-            ao_result = "AO Region"
-        elif self.misc_functions.str_contains(dirname, ["z_autoortho"]):
-            ao_result = "AO Root"
+        for ao_quirk in ("AO Overlay", "AO Region", "AO Root"):
+            if ao_quirk in quirks:
+                ao_result = ao_quirk
+                break
         if self.verbose >= 2 and ao_result:
             print(f"    [I] SortPacks process_quirk_ao: found to be {ao_result}")
         return ao_result
@@ -618,7 +684,7 @@ class SortPacks:
     # Called in process_type_mesh and process_main
     def process_quirk_prefab(self, dirname: str) -> str:
         prefab_result = None
-        if self.misc_functions.str_contains(dirname, ["prefab"], casesensitive=False):
+        if "Prefab Apt" in self.process_quirks(dirname):
             prefab_result = "Prefab Apt"
         if self.verbose >= 2 and prefab_result:
             print(f"    [I] SortPacks process_quirk_prefab: found to be {prefab_result}")
@@ -628,42 +694,39 @@ class SortPacks:
     # Called in process_type_mesh and process_type_other
     def process_quirk_simheaven(self, dirname: str) -> str:
         simheaven_result = None
-        if self.misc_functions.str_contains(dirname, ["simheaven"], casesensitive=False):
+        if "SimHeaven" in self.process_quirks(dirname):
             simheaven_result = "SimHeaven"
         if self.verbose >= 2 and simheaven_result:
             print(f"    [I] SortPacks process_quirk_simheaven: found to be {simheaven_result}")
         return simheaven_result
 
     # Classify the pack
-    def process_main(self, path, shortcut=False) -> None:
+    # Airport registries aren't touched here, the ICAO codes found are returned for the caller to register in pack order
+    def process_main(self, path, shortcut=False) -> typing.Union[AirportRecord, None]:
         # Make sure we're not processing our own temp folder
-        if str(self.temp_path) in str(path):
+        if self.temp_dir.path_str and str(path).startswith(self.temp_dir.path_str):
             return
         # Bring data to formats required by classifier functions
-        abs_path = self.xplane_path / "Custom Scenery" / path
+        abs_path = self.scenery_path / path
         name = str(path)
         classified = False
+        airport_record = None
+        # Scan the pack once and share the listing between all the classifier stages
+        pack_entries = self.misc_functions.dir_scan(abs_path)
         # Define path formatted for ini
         if shortcut:
             ini_path = str(abs_path)
         else:
             ini_path = str(path)
         # Define line formatted for ini
-        disable = ini_path in self.disable_registry
-        if disable:
-            del self.disable_registry[ini_path]
-            if shortcut:
-                line = f"{FILE_DISAB_LINE_ABS}{ini_path}/\n"
-            else:
-                line = f"{FILE_DISAB_LINE_REL}{ini_path}/\n"
-        else:
-            if shortcut:
-                line = f"{FILE_LINE_ABS}{ini_path}/\n"
-            else:
-                line = f"{FILE_LINE_REL}{ini_path}/\n"
+        # Pop in one hashed lookup, so whatever is left over is known to be missing
+        disable = self.disable_registry.pop(ini_path, None) is not None
+        line = f"{FILE_LINE_PREFIXES[(disable, shortcut)]}{ini_path}/\n"
         # First see if it's an airport
         if not classified:
-            pack_type = self.process_type_apt(abs_path, name, line, disable)
+            pack_type, apt_icaos = self.process_type_apt(abs_path, name, disable, pack_entries)
+            if apt_icaos:
+                airport_record = AirportRecord(abs_path, line, apt_icaos)
             classified = True
             # Standard definitions
             if pack_type in ["Global", "Default", "Custom"]:
@@ -679,7 +742,7 @@ class SortPacks:
                 classified = False
         # Next, autortho, overlay, ortho or mesh
         if not classified:
-            pack_type = self.process_type_mesh(abs_path, name)
+            pack_type = self.process_type_mesh(abs_path, name, pack_entries)
             if not pack_type:
                 pack_type = self.process_quirk_ao(name)
             classified = True
@@ -701,7 +764,7 @@ class SortPacks:
                 classified = False
         # Very lax checks for plugins and libraries
         if not classified:
-            pack_type = self.process_type_other(abs_path, name)
+            pack_type = self.process_type_other(abs_path, name, pack_entries)
             classified = True
             # Standard definitions
             if pack_type in ["Plugin", "Library"]:
@@ -720,38 +783,56 @@ class SortPacks:
             if self.verbose >= 2:
                 print(f"  [W] SortPacks process_main: could not be classified")
             if line.startswith(FILE_DISAB_LINE_ABS):
-                self.unsorted_registry.append(line[22:])
+                self.unsorted_registry.append(line[FILE_DISAB_LINE_ABS_LEN:])
             elif line.startswith(FILE_LINE_ABS):
-                self.unsorted_registry.append(line[13:])
+                self.unsorted_registry.append(line[FILE_LINE_ABS_LEN:])
             else:
                 pass
+        return airport_record
+
+    # Register the ICAO codes of an airport pack. Always called from the main thread in pack order, so the registries
+    # come out the same every run no matter which thread finished first
+    def process_airport_record(self, airport_record: typing.Union[AirportRecord, None]) -> None:
+        if airport_record is None:
+            return
+        self.icao_registry.update(airport_record.icaos)
+        self.airport_registry[airport_record.path] = {"line": airport_record.line, "icaos": airport_record.icaos}
 
     # Process folders and symlinks
     def main_folders(self) -> None:
-        maxlength = 0
-        folder_list = self.misc_functions.dir_list(self.xplane_path / "Custom Scenery", "dirs")
+        folder_list = self.misc_functions.dir_list(self.scenery_path, "dirs")
         folder_list.sort()
-        for directory in folder_list:
-            if self.verbose >= 1:
+        # Verbose runs stay sequential so the log for each pack isn't interleaved with others
+        if self.verbose >= 1:
+            for directory in folder_list:
                 print(f"Main: Starting dir: {directory}")
-            else:
-                # Whitespace padding to print in the shell
-                progress_str = f"Processing: {directory}"
-                if len(progress_str) <= maxlength:
-                    progress_str = f"{progress_str}{' ' * (maxlength - len(progress_str))}"
-                else:
-                    maxlength = len(progress_str)
-                print(f"\r{progress_str}", end="\r")
-            self.process_main(directory)
-            if self.verbose >= 1 and self.verbose < 2:
-                print(f"Main: Finished dir: {directory}")
+                self.process_airport_record(self.process_main(directory))
+                if self.verbose < 2:
+                    print(f"Main: Finished dir: {directory}")
+            return
+        # Classification is mostly I/O bound, so spread it over threads. Progress is shown in order as packs finish
+        last_progress = 0.0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            # executor.map gives results back in folder_list order, so airports are registered in the same order as a sequential run
+            for count, (directory, airport_record) in enumerate(zip(folder_list, executor.map(self.process_main, folder_list)), 1):
+                self.process_airport_record(airport_record)
+                # Only refresh the progress line every so often, but always show the last pack
+                now = time.monotonic()
+                if now - last_progress < PROGRESS_INTERVAL and count < len(folder_list):
+                    continue
+                last_progress = now
+                self.main_progress(f"Processed {count}/{len(folder_list)}: {directory}")
+
+    # Overwrite the progress line in the shell. Pad and clip it to the terminal, so it never wraps and always covers the previous one
+    def main_progress(self, progress_str: str) -> None:
+        progress_width = shutil.get_terminal_size().columns - 1
+        sys.stdout.write(f"\r{progress_str[:progress_width]:<{progress_width}}\r")
+        sys.stdout.flush()
 
     # Process Windows Shortcuts
     def main_shortcuts(self) -> None:
-        maxlength = 0
         printed = False
-        shtcut_list = [str(self.xplane_path / "Custom Scenery" / shtcut) for shtcut in
-                       self.misc_functions.dir_list(self.xplane_path / "Custom Scenery", "files") if shtcut.endswith(".lnk")]
+        shtcut_list = [str(self.scenery_path / shtcut) for shtcut in self.misc_functions.dir_list(self.scenery_path, "files", ".lnk")]
         shtcut_list.sort()
         if shtcut_list and sys.platform != "win32":
             print(f"I found Windows .LNK shortcuts, but I'm not on Windows! Detected platform: {sys.platform}")
@@ -766,15 +847,9 @@ class SortPacks:
                     if self.verbose >= 1:
                         print(f"Main: Starting shortcut: {folder_path}")
                     else:
-                        # Whitespace padding to print in the shell
-                        progress_str = f"Processing shortcut: {str(folder_path)}"
-                        if len(progress_str) <= maxlength:
-                            progress_str = f"{progress_str}{' ' * (maxlength - len(progress_str))}"
-                        else:
-                            maxlength = len(progress_str)
-                        print(f"\r{progress_str}", end="\r")
+                        self.main_progress(f"Processing shortcut: {str(folder_path)}")
                         printed = True
-                    self.process_main(folder_path, shortcut=True)
+                    self.process_airport_record(self.process_main(folder_path, shortcut=True))
                     if self.verbose >= 1 and self.verbose < 2:
                         print(f"Main: Finished shortcut: {folder_path}")
                     continue
@@ -797,18 +872,12 @@ class SortPacks:
 
     # Cleanup after processing
     def main_cleanup(self) -> None:
-        # Sort tiers alphabetically
+        # Sort tiers alphabetically. Lists are mostly in order already, which Timsort handles in close to a single pass
+        # The dsf error registry isn't sorted, it's only shown in verbose runs, which classify sequentially
         self.unsorted_registry.sort()
-        for key in self.quirks:
-            self.quirks[key].sort()
-        for key in self.airports:
-            self.airports[key].sort()
-        for key in self.overlays:
-            self.overlays[key].sort()
-        for key in self.meshes:
-            self.meshes[key].sort()
-        for key in self.other:
-            self.other[key].sort()
+        for tier in (self.quirks, self.airports, self.overlays, self.meshes, self.other):
+            for pack_list in tier.values():
+                pack_list.sort()
         # Check to inject XP12 Global Airports
         if not self.airports["Global"]:
             if self.verbose >= 1:
@@ -842,24 +911,18 @@ class SortPacks:
             print("\nI was unable to classify some packs. Maybe the pack is empty? Otherwise, a folder-in-folder?")
             print("I will list them out now")
             for line in self.unsorted_registry:
-                line_stripped = line.strip("\n")
+                line_stripped = line.rstrip("\n")
                 print(f"    {line_stripped}")
             print("Note that if you choose not to write them, they will be written as DISABLED packs to prevent unexpected errors.")
             while True:
                 choice = input("Should I still write them into the ini? (yes/no or y/n): ").lower()
                 if choice in ["y", "yes"]:
                     print("Ok, I will write them at the top of the ini.")
-                    tmp_unsorted_registry = []
-                    for line in self.unsorted_registry:
-                        tmp_unsorted_registry.append(f"{FILE_LINE_ABS}{line}")
-                    self.unsorted_registry = copy.deepcopy(tmp_unsorted_registry)
+                    self.unsorted_registry = [f"{FILE_LINE_ABS}{line}" for line in self.unsorted_registry]
                     break
                 elif choice in ["n", "no"]:
                     print("Ok, I will write them at the top of the ini as DISABLED packs.")
-                    tmp_unsorted_registry = []
-                    for line in self.unsorted_registry:
-                        tmp_unsorted_registry.append(f"{FILE_DISAB_LINE_ABS}{line}")
-                    self.unsorted_registry = copy.deepcopy(tmp_unsorted_registry)
+                    self.unsorted_registry = [f"{FILE_DISAB_LINE_ABS}{line}" for line in self.unsorted_registry]
                     break
                 else:
                     print("  Sorry, I didn't understand.")
@@ -876,7 +939,7 @@ class OverlapResolve:
         self.airport_registry = airport_data.airport_registry
         self.airports = sort_result.airports
         # Internal Airport related declarations
-        self.icao_overlaps = []
+        self.icao_overlaps = set()
         self.airport_list = {}
         self.airport_list_num = 0
         self.airport_resolve_choice = False
@@ -888,38 +951,24 @@ class OverlapResolve:
         self.airport_ask()
         print()
         self.airport_resolve()
-        # Prepare data and return
-        sort_result_new = SortPacksResult(self.sort_result.unsorted_registry,
-                                          self.sort_result.quirks,
-                                          self.airports,
-                                          self.sort_result.overlays,
-                                          self.sort_result.meshes,
-                                          self.sort_result.other)
-        return sort_result_new
+        # Prepare data and return. Only the airports change, so hand the rest of the sort result straight through
+        return self.sort_result._replace(airports=self.airports)
 
     # Go through airport registries, list out conflicts and add to our records
     def airport_search(self) -> None:
         # Check how many conflicting ICAOs we have and store them in icao_overlaps
-        for icao in self.icao_registry:
-            if self.icao_registry[icao] > 1:
-                self.icao_overlaps.append(icao)
+        self.icao_overlaps = {icao for icao, count in self.icao_registry.items() if count > 1}
         # Display conflicting packs in a list
-        for reg_index in range(len(self.airport_registry["path"])):
-            airport_path = self.airport_registry["path"][reg_index]
-            airport_line = self.airport_registry["line"][reg_index]
-            airport_icaos = self.airport_registry["icaos"][reg_index]
+        for airport_path, airport_entry in self.airport_registry.items():
+            airport_line = airport_entry["line"]
+            airport_icaos = airport_entry["icaos"]
             # Check if this airport's ICAOs are among the conflicting ones. If not, skip it
-            airport_icaos_conflicting = list(set(airport_icaos) & set(self.icao_overlaps))
-            airport_icaos_conflicting.sort()
-            if airport_icaos_conflicting:
-                pass
-            else:
+            airport_icaos_conflicting = sorted(self.icao_overlaps.intersection(airport_icaos))
+            if not airport_icaos_conflicting:
                 continue
             # Print path and ICAOs
-            airport_icao_string = ""
-            for icao in airport_icaos_conflicting:
-                airport_icao_string += f"{icao} "
-            print(f"    {self.airport_list_num}: '{airport_path}': {airport_icao_string[:-1]}")
+            airport_icao_string = " ".join(airport_icaos_conflicting)
+            print(f"    {self.airport_list_num}: '{airport_path}': {airport_icao_string}")
             # Log this with the number in list
             self.airport_list[self.airport_list_num] = airport_line
             # Incremenent i for the next pack
@@ -970,21 +1019,21 @@ class OverlapResolve:
             if not valid_flag:
                 print("    I recommend you read the instructions if you're not sure what to do.")
                 print("    For now though, I will show a basic example for your case below.")
-                example_str = ""
-                for i in range(self.airport_list_num):
-                    example_str += f"{i},"
-                print(f"    {example_str[:-1]}")
+                example_str = ",".join(str(i) for i in range(self.airport_list_num))
+                print(f"    {example_str}")
                 print("    You can copy-paste this as-is, or move the numbers around as you like.")
             # If this input's valid, move on
             else:
                 break
-        # Manipulate custom airports list
-        tmp_customairports = copy.deepcopy(self.airports["Custom"])
-        tmp_customoverlaps = list()
-        for i in order:
-            tmp_customoverlaps.append(tmp_customairports.pop(tmp_customairports.index(self.airport_list[i])))
-        tmp_customoverlaps.extend(tmp_customairports)
-        self.airports["Custom"] = copy.deepcopy(tmp_customoverlaps)
+        # Manipulate custom airports list: chosen packs in the order given, then the rest in their existing order
+        custom_index = {}
+        for index, line in enumerate(self.airports["Custom"]):
+            custom_index.setdefault(line, index)
+        chosen_index = [custom_index[self.airport_list[i]] for i in order]
+        chosen_set = set(chosen_index)
+        tmp_customoverlaps = [self.airports["Custom"][index] for index in chosen_index]
+        tmp_customoverlaps.extend(line for index, line in enumerate(self.airports["Custom"]) if index not in chosen_set)
+        self.airports["Custom"] = tmp_customoverlaps
 
 
 class WriteINI:
@@ -1012,22 +1061,14 @@ class WriteINI:
         # Write new ini
         self.write()
 
-    # Clear old backup, move existing ini to backup
+    # Move existing ini to backup, replacing the old backup in the same step
     def backup(self) -> typing.Union[None, Exception]:
-        # Remove the old backup file, if present
-        try:
-            if self.ini_path_backedup.exists():
-                print("I will now delete the old scenery_packs.ini.bak")
-                self.ini_path_backedup.unlink()
-        # Safety net
-        except Exception as e:
-            print(f"Failed to delete! Maybe check the file permissions? Error: '{e}'")
-            return e
-        # Back up the current scenery_packs.ini file
         try:
-            if self.ini_path_deployed.exists():
-                print("I will now back up the current scenery_packs.ini")
-                self.ini_path_deployed.rename(self.ini_path_backedup)
+            os.replace(self.ini_path_deployed, self.ini_path_backedup)
+            print("I have backed up the current scenery_packs.ini, replacing any old scenery_packs.ini.bak")
+        # Nothing to back up, so leave any old backup alone
+        except FileNotFoundError:
+            pass
         # Safety net
         except Exception as e:
             print(f"Failed to rename .ini to .ini.bak! Maybe check the file permissions? Error: '{e}'")
@@ -1055,25 +1096,24 @@ class WriteINI:
             "meshes: terrain": self.meshes["Terrain"]
         }
         # Write unsorted packs to scenery_packs_unsorted.ini
-        with open(self.ini_path_unsorted, "w+", encoding="utf-8") as f:
-            f.write(FILE_BEGIN)
-            if packs["unsorted"]:
-                f.writelines(packs["unsorted"])
+        with open(self.ini_path_unsorted, "w", encoding="utf-8") as f:
+            f.write("".join([FILE_BEGIN, *packs["unsorted"]]))
+        # Build everything for scenery_packs.ini, and the verbose listing alongside it
+        ini_parts = [FILE_BEGIN]
+        log_parts = []
+        for pack_type, pack_list in packs.items():
+            ini_parts.extend(pack_list)
+            if self.verbose >= 1:
+                log_parts.append(f"{pack_type}\n")
+                if pack_list:
+                    log_parts.extend(f"    {pack.strip()}\n" for pack in pack_list)
+                else:
+                    log_parts.append(f"    --empty--\n")
         # Write everything to scenery_packs.ini
-        with open(self.ini_path_deployed, "w+", encoding="utf-8") as f:
-            f.write(FILE_BEGIN)
-            for pack_type in packs:
-                pack_list = packs[pack_type]
-                if pack_list and self.verbose >= 1:
-                    print(pack_type)
-                    f.writelines(pack_list)
-                    for pack in pack_list:
-                        print(f"    {pack.strip()}")
-                elif self.verbose >= 1:
-                    print(pack_type)
-                    print(f"    --empty--")
-                elif pack_list:
-                    f.writelines(pack_list)
+        with open(self.ini_path_deployed, "w", encoding="utf-8") as f:
+            f.write("".join(ini_parts))
+        if log_parts:
+            sys.stdout.write("".join(log_parts))
         print("Done!")
 
 
@@ -1082,10 +1122,15 @@ class LaunchXPlane:
         # External variable declarations
         self.verbose = verbose
         self.xplane_path = xplane_path
-
-    # Get, set, go
-    def main(self) -> None:
-        # Get X-Plane executable name. If unsupported platform, exit
+        # Internal variable declarations
+        self.xplane_exe = None
+        self.preflight_error = None
+        self.preflight_done = False
+
+    # Locate and check the X-Plane executable. This doesn't need user input, so it can run while the ini is written
+    def preflight(self) -> None:
+        self.preflight_done = True
+        # Get X-Plane executable name. If unsupported platform, note it
         xplane_exe = None
         if sys.platform == "win32":
             xplane_exe = "X-Plane.exe"
@@ -1095,13 +1140,24 @@ class LaunchXPlane:
             xplane_exe = "X-Plane-x86_64"
 
         if xplane_exe is None:
-            input("Unsupported platform for X-Plane. Press enter to close")
+            self.preflight_error = "Unsupported platform for X-Plane. Press enter to close"
             return
-        # Get X-Plane executable path and check if present. If not, exit
+        # Get X-Plane executable path and check if present. If not, note it
         xplane_exe = self.xplane_path / xplane_exe
         if (sys.platform in ["win32", "linux"] and not xplane_exe.is_file()) or (sys.platform == "darwin" and not xplane_exe.is_dir()):
-            input("X-Plane executable is invalid or could not be found. Press enter to close")
+            self.preflight_error = "X-Plane executable is invalid or could not be found. Press enter to close"
+            return
+        self.xplane_exe = xplane_exe
+
+    # Get, set, go
+    def main(self) -> None:
+        # Check the executable if that wasn't already done. If there was a problem, exit
+        if not self.preflight_done:
+            self.preflight()
+        if self.preflight_error:
+            input(self.preflight_error)
             return
+        xplane_exe = self.xplane_exe
         # Ask the user if they wish to launch X-Plane. If no, exit
         choice_launch = None
         while True:
@@ -1123,159 +1179,221 @@ class LaunchXPlane:
             os.system(f'open -a "{str(xplane_exe)}"')
 
 
+class LazyTempDir:
+    def __init__(self, verbose: int) -> None:
+        # External variable declarations
+        self.verbose = verbose
+        # Internal variable declarations
+        self.path = None
+        self.path_str = ""
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "LazyTempDir":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    # Get the temporary directory, creating it on first use. Packs are classified in threads, hence the lock
+    def get(self) -> pathlib.Path:
+        with self.lock:
+            if self.path is None:
+                # Deferred import, most runs never get here
+                import tempfile
+                self.path = pathlib.Path(tempfile.mkdtemp())
+                self.path_str = str(self.path)
+                if self.verbose >= 1:
+                    print("created temporary directory", self.path)
+        return self.path
+
+
 class misc_functions:
     def __init__(self, verbose: int) -> None:
         # External variable declarations
         self.verbose = verbose
+        # Internal variable declarations
+        self.shell_link = None  # IShellLink and IPersistFile pair, created on the first Windows shortcut and reused
 
     # Read Windows shortcuts
     # The non-Windows code is from https://gist.github.com/Winand/997ed38269e899eb561991a0c663fa49
     def parse_shortcut(self, sht_path: str) -> pathlib.Path:
         tgt_path = None
         if sys.platform == "win32":
-            import win32com.client
-            shell = win32com.client.Dispatch("WScript.Shell")
-            tgt_path = shell.CreateShortCut(sht_path).Targetpath
+            # Load the link through IShellLink directly, skipping the WScript.Shell automation server
+            try:
+                import pythoncom
+                import pywintypes
+                from win32com.shell import shell
+            except ImportError:
+                shell = None
+            if shell is not None:
+                try:
+                    if self.shell_link is None:
+                        link = pythoncom.CoCreateInstance(shell.CLSID_ShellLink, None, pythoncom.CLSCTX_INPROC_SERVER, shell.IID_IShellLink)
+                        self.shell_link = (link, link.QueryInterface(pythoncom.IID_IPersistFile))
+                    link, link_file = self.shell_link
+                    link_file.Load(sht_path, 0)
+                    tgt_path, _ = link.GetPath(shell.SLGP_UNCPRIORITY)
+                except pywintypes.com_error as e:
+                    if self.verbose >= 2:
+                        print(f"  [W] misc_functions parse_shortcut: IShellLink failed on {sht_path} '{e}'. falling back to WScript")
+            # Fall back to the WScript.Shell automation server
+            if tgt_path is None:
+                import win32com.client
+                wscript_shell = win32com.client.Dispatch("WScript.Shell")
+                tgt_path = wscript_shell.CreateShortCut(sht_path).Targetpath
         else:
             if self.verbose >= 1:
                 print(f"  [W] misc_functions parse_shortcut: not on windows but made to parse {sht_path}")
             with open(sht_path, "rb") as stream:
                 content = stream.read()
-                lflags = struct.unpack("I", content[0x14:0x18])[0]
+                lflags = LNK_UINT.unpack_from(content, 0x14)[0]
                 position = 0x18
                 if (lflags & 0x01) == 1:
-                    position = struct.unpack("H", content[0x4C:0x4E])[0] + 0x4E
+                    position = LNK_USHORT.unpack_from(content, 0x4C)[0] + 0x4E
                 last_pos = position
-                position += 0x04
-                length = struct.unpack("I", content[last_pos:position])[0]
-                position += 0x0C
-                lbpos = struct.unpack("I", content[position:position + 0x04])[0]
+                length = LNK_UINT.unpack_from(content, last_pos)[0]
+                lbpos = LNK_UINT.unpack_from(content, last_pos + 0x10)[0]
                 position = last_pos + lbpos
                 size = (length + last_pos) - position - 0x02
                 content = content[position:position + size].split(b"\x00", 1)
                 tgt_path = content[-1].decode("utf-16" if len(content) > 1 else locale.getdefaultlocale()[1])
         return pathlib.Path(tgt_path)
 
-    # Get the list of all directories inside a parent directory
-    def dir_list(self, directory: pathlib.Path, result: str) -> list:
-        dirlist = []
-        for _, dirnames, filenames in os.walk(directory):
-            if result == "dirs":
-                dirlist.extend(dirnames)
-            elif result == "files":
-                dirlist.extend(filenames)
-            break
-        return dirlist
+    # Hash a file's contents for cache validation. Not used for anything security related
+    def file_hash(self, filepath: pathlib.Path) -> str:
+        with open(filepath, "rb") as file:
+            # Python 3.11+ can do the read loop in C
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(file, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+            digest = hashlib.blake2b(digest_size=16)
+            for data in iter(lambda: file.read(BUF_SIZE), b""):
+                digest.update(data)
+        return digest.hexdigest()
+
+    # Get the entries inside a parent directory, with their cached type information
+    # Unreadable directories are treated as empty
+    def dir_scan(self, directory: pathlib.Path) -> list:
+        try:
+            with os.scandir(directory) as entries:
+                return list(entries)
+        except OSError:
+            return []
+
+    # Like os.walk, symlinks to directories count as directories
+    def entry_is_dir(self, entry: os.DirEntry) -> bool:
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
+
+    # Get the list of all directories or files inside a parent directory, optionally only those with a given suffix
+    def dir_list(self, directory: pathlib.Path, result: str, suffix: str = "") -> list:
+        want_dirs = result == "dirs"
+        return [entry.name for entry in self.dir_scan(directory) if entry.name.endswith(suffix) and self.entry_is_dir(entry) == want_dirs]
 
     # Check if a directory contains a folder or file (case insensitive)
     # Ignore items list and return case-sensitive path for apt.dat or Earth nav data calls
-    def dir_contains(self, directory: pathlib.Path, items: list, variant: str = None) -> typing.Union[pathlib.Path, bool]:
+    # If the directory was already scanned, pass its entries to skip scanning it again
+    def dir_contains(self, directory: pathlib.Path, items: list, variant: str = None, entries: list = None) -> typing.Union[pathlib.Path, bool]:
+        if entries is None and variant != "apt.dat":
+            entries = self.dir_scan(directory)
         # First find Earth nav data folder through recursion, then search for apt.dat file within it
         if variant == "apt.dat":
-            end_folder = self.dir_contains(directory, None, variant="Earth nav data")
+            end_folder = self.dir_contains(directory, None, "Earth nav data", entries)
             if end_folder:
-                list_files = self.dir_list(end_folder, "files")
-                for file in list_files:
-                    if file.lower() == "apt.dat":
-                        return directory / end_folder / file
+                for entry in self.dir_scan(end_folder):
+                    if entry.name.lower() == "apt.dat" and not self.entry_is_dir(entry):
+                        return end_folder / entry.name
         # Find Earth nav data folder and return case-sensitive path
         elif variant == "Earth nav data":
-            list_dirs = self.dir_list(directory, "dirs")
-            for folder in list_dirs:
-                if folder.lower() == "earth nav data":
-                    return directory / folder
-        # Find if file or folder is present
+            for entry in entries:
+                if entry.name.lower() == "earth nav data" and self.entry_is_dir(entry):
+                    return directory / entry.name
+        # Find if all files or folders are present
         elif variant in [None, "generic"]:
-            item_present = {}
-            list_obj = self.dir_list(directory, "files" if variant == "generic" else "dirs")
-            for item in items:
-                item_present[item] = False
-                for obj in list_obj:
-                    if obj.lower() == item.lower():
-                        item_present[item] = True
+            want_dirs = variant != "generic"
+            items_missing = {item.lower() for item in items}
+            for entry in entries:
+                if entry.name.lower() in items_missing and self.entry_is_dir(entry) == want_dirs:
+                    items_missing.discard(entry.name.lower())
+                    if not items_missing:
                         break
-            for present in item_present.values():
-                if not present:
-                    return False
-            return True
+            return not items_missing
 
     # Check if any of the items in a list are present in a given string
     # Used for checking if a scenery package is default
-    def str_contains(self, searchstr: str, itemslist: list, casesensitive: bool = True) -> bool:
-        for item in itemslist:
-            if casesensitive and item in searchstr:
-                return True
-            elif not casesensitive and item.lower() in searchstr.lower():
-                return True
-        return False
+    def str_contains(self, searchstr: str, itemslist: typing.Iterable[str], casesensitive: bool = True) -> bool:
+        if not casesensitive:
+            searchstr = searchstr.lower()
+            itemslist = [item.lower() for item in itemslist]
+        return any(item in searchstr for item in itemslist)
 
 
 # Pack importing
 def __init__() -> None:
-    shutil.register_unpack_format("7zip", [".7z", ".dsf"], py7zr.unpack_7zarchive)
+    # Only register once, shutil refuses duplicate registrations if main() is called again in the same interpreter
+    if "7zip" not in (unpack_format[0] for unpack_format in shutil.get_unpack_formats()):
+        shutil.register_unpack_format("7zip", [".7z", ".dsf"], py7zr.unpack_7zarchive)
     print("Scenery Pack Organiser: version 3.0r1")
 
 
 # Main flow
-def main_flow(verbose: int, temp_path: pathlib.Path) -> int:
+def main_flow(verbose: int, temp_dir: LazyTempDir, paranoid: bool = False, no_launch: bool = False) -> int:
     # Part 1: Locate X-Plane
-    time.sleep(2)
-    print("\nFirst, let's find X-Plane!\n")
-    time.sleep(2)
+    sys.stdout.write("\nFirst, let's find X-Plane!\n\n")
     part1 = LocateXPlane(verbose)
     xplane_path = part1.main()
 
     # Part 2: Sort packs and get data required for Part 3
-    time.sleep(2)
-    print("\n\nCool!")
-    time.sleep(2)
-    print("\nNow hang tight while I go through your scenery packs...\n")
-    part2 = SortPacks(verbose, xplane_path, temp_path)
+    sys.stdout.write("\n\nCool!\n\nNow hang tight while I go through your scenery packs...\n\n")
+    part2 = SortPacks(verbose, xplane_path, temp_dir, paranoid)
     sort_result, airport_data = part2.main()
 
     # Part 3: Resolve overlaps in Airports
-    print("\n\nNow that that's done, let's see if you have any overlapping airports!\n")
-    time.sleep(2)
+    sys.stdout.write("\n\nNow that that's done, let's see if you have any overlapping airports!\n\n")
     part3 = OverlapResolve(verbose, sort_result, airport_data)
     sort_result = part3.main()
 
     # Part 4: Write the ini and store any exceptions encountered
-    time.sleep(2)
-    print("\n\nCool!")
-    time.sleep(2)
-    print("\nNow I'll write all this to the .ini!\n")
-    time.sleep(2)
+    sys.stdout.write("\n\nCool!\n\nNow I'll write all this to the .ini!\n\n")
     part4 = WriteINI(verbose, xplane_path, sort_result)
-    ini_error = part4.main()
-
-    # Part 5: Launch X-Plane ONLY IF no errors in Part 4
-    time.sleep(2)
-    print("\n\nLast... launching X-Plane!\n")
-    time.sleep(2)
+    # Skip Part 5 altogether if asked not to launch
+    if no_launch:
+        ini_error = part4.main()
+        return 255 if ini_error else 0
+    # Check the X-Plane executable for Part 5 while the ini is being written
     part5 = LaunchXPlane(verbose, xplane_path)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        preflight = executor.submit(part5.preflight)
+        ini_error = part4.main()
+        preflight.result()
     if ini_error:
         return 255
-    else:
-        part5.main()
-        return 0
+
+    # Part 5: Launch X-Plane ONLY IF no errors in Part 4
+    sys.stdout.write("\n\nLast... launching X-Plane!\n\n")
+    part5.main()
+    return 0
 
 def main() -> int:
     """Today's the day :D"""
     __init__()
 
+    # Deferred import to keep it out of module load
+    import argparse
     argparser = argparse.ArgumentParser()
-    argparser.add_argument("-d", "--verbose", type=int, choices=[0, 1, 2], dest="verbose_level")
+    argparser.add_argument("-d", "--verbose", type=int, choices=[0, 1, 2], dest="verbose_level", default=0)
+    argparser.add_argument("--paranoid", action="store_true", help="hash cached DSFs instead of trusting size and mtime")
+    argparser.add_argument("--no-launch", action="store_true", help="exit after writing the ini instead of offering to launch X-Plane")
 
     args = argparser.parse_args()
     verbose_level = args.verbose_level
-    if verbose_level is None:
-        verbose_level = 0
-
-    # create a temporary directory using the context manager
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        if verbose_level >= 1:
-            print("created temporary directory", tmpdirname)
-        return_code = main_flow(verbose_level, pathlib.Path(tmpdirname))
+
+    # temporary directory is only created if a DSF needs extracting
+    with LazyTempDir(verbose_level) as temp_dir:
+        return_code = main_flow(verbose_level, temp_dir, args.paranoid, args.no_launch)
     # temporary directory and contents have been removed
     return return_code
 